@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List
+
+MODES = ("off", "record", "replay")
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMiss(LookupError):
+    """Raised when replaying a prompt that was never recorded"""
+
+
+class Cassette:
+    """Append-only JSONL store of upstream completions used for record/replay runs.
+
+    Each line holds one completion keyed by a hash of the rendered prompt, together
+    with its token usage and the latency observed when it was recorded.
+    """
+
+    def __init__(self, path: str, mode: str = "off", replay_latency: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Cassette mode must be one of: {list(MODES)}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if self.replaying:
+            self.load()
+
+    @classmethod
+    def from_env(cls) -> "Cassette":
+        """Build a cassette from OPENAI_CASSETTE_* environment variables"""
+        return cls(
+            path=os.environ.get("OPENAI_CASSETTE_PATH", "cassettes/openai.jsonl"),
+            mode=os.environ.get("OPENAI_CASSETTE_MODE", "off").lower(),
+            replay_latency=os.environ.get("OPENAI_CASSETTE_REPLAY_LATENCY", "false").lower() in ("1", "true", "yes")
+        )
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def key(prompt: str) -> str:
+        """Stable key for a rendered prompt"""
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:32]
+
+    def load(self) -> None:
+        """Load every recorded completion, grouped by prompt key"""
+        self._entries.clear()
+        self._cursor.clear()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    key = entry["key"]
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    # Typically a partial append from a recorder that was killed mid-write
+                    logger.warning("Skipping malformed cassette line %s:%d (%s)", self.path, line_number, e)
+                    continue
+                self._entries.setdefault(key, []).append(entry)
+
+    async def record(self, prompt: str, entry: Dict[str, Any]) -> None:
+        """Append a completion for the given prompt to the cassette file without blocking the event loop"""
+        line = json.dumps({"key": self.key(prompt), **entry}, separators=(",", ":"), ensure_ascii=False)
+        await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: str) -> None:
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def lookup(self, prompt: str) -> Dict[str, Any]:
+        """Return a recorded completion for the prompt, cycling through repeated recordings"""
+        key = self.key(prompt)
+        entries = self._entries.get(key)
+        if not entries:
+            raise CassetteMiss(f"No recorded completion for prompt key {key}")
+        with self._lock:
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+        return entries[index % len(entries)]
@@ -1,33 +1,309 @@
-from typing import List, Optional, Dict, Any
-from openai import OpenAI
+from typing import List, Optional, Dict, Any, AsyncIterator
+from openai import AsyncOpenAI
+import asyncio
+import json
 import os
+import time
 from utils.libs import Libs
 from fastapi import FastAPI, HTTPException
 from dotenv import load_dotenv
+from model_interact.cassette import Cassette, CassetteMiss
+from utils.deadlines import await_upstream, cancellation_stats
+from utils.token_budget import token_budgeter
 
 # Load .env file
 load_dotenv()
 utils= Libs()
 utils.load_env()
-# Initialize OpenAI client
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+MODEL = "gpt-4o-mini"
 
+# Record/replay of upstream completions (OPENAI_CASSETTE_MODE=off|record|replay)
+cassette = Cassette.from_env()
 
-# Helper function to call OpenAI API
-async def call_openai(prompt: str, temperature: float = 0.7, max_tokens: int = 500) -> Dict[str, Any]:
+# Initialize OpenAI client (not needed when replaying offline)
+client = None if cassette.replaying else AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+
+async def _replay_openai(prompt: str) -> Dict[str, Any]:
+    """Serve a completion from the cassette instead of the live API"""
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        entry = cassette.lookup(prompt)
+    except CassetteMiss as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI replay error: {str(e)}")
+
+    if cassette.replay_latency:
+        await asyncio.sleep(entry["latency"])
+
+    return {
+        "response": entry["choices"][0]["content"],
+        "tokens_used": entry["total_tokens"],
+        "prompt_tokens": entry["prompt_tokens"],
+        "completion_tokens": entry["completion_tokens"],
+        "latency": entry["latency"],
+        "finish_reason": entry["choices"][0]["finish_reason"],
+        "model": entry["model"]
+    }
+
+
+async def _record_completion(prompt: str, temperature: float, max_tokens: int, latency: float,
+                             usage: Any, choices: List[Dict[str, Any]]) -> None:
+    """Append a live completion to the cassette"""
+    await cassette.record(prompt, {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "model": MODEL,
+        "latency": round(latency, 4),
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "choices": choices
+    })
+
+
+def render_messages(messages: List[Dict[str, str]]) -> str:
+    """Render a chat transcript into a single string, used as its cassette key"""
+    return json.dumps(messages, separators=(",", ":"), ensure_ascii=False)
+
+
+async def _complete_openai(prompt: str, temperature: float, max_tokens: int) -> Dict[str, Any]:
+    """Single upstream completion, live or replayed"""
+    if cassette.replaying:
+        return await await_upstream(_replay_openai(prompt), max_tokens)
+
+    try:
+        started = time.perf_counter()
+        response = await await_upstream(client.chat.completions.create(
+            model=MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=temperature,
             max_tokens=max_tokens
+        ), max_tokens)
+        latency = time.perf_counter() - started
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+    cancellation_stats.observe(response.usage.completion_tokens, latency)
+
+    if cassette.recording:
+        await _record_completion(prompt, temperature, max_tokens, latency, response.usage, [
+            {"content": choice.message.content, "finish_reason": choice.finish_reason}
+            for choice in response.choices
+        ])
+
+    return {
+        "response": response.choices[0].message.content,
+        "tokens_used": response.usage.total_tokens,
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "latency": round(latency, 4),
+        "finish_reason": response.choices[0].finish_reason,
+        "model": MODEL
+    }
+
+
+# Helper function to call OpenAI API
+async def call_openai(prompt: str, temperature: float = 0.7, max_tokens: int = 500,
+                      budget_key: Optional[str] = None) -> Dict[str, Any]:
+    """With a budget_key, max_tokens is the ceiling and the adaptive budget for that key is requested;
+    completions truncated by a budget below the ceiling are retried once at the ceiling."""
+    if budget_key is None:
+        return await _complete_openai(prompt, temperature, max_tokens)
+
+    budget = token_budgeter.budget(budget_key, max_tokens)
+    result = await _complete_openai(prompt, temperature, budget)
+    if result["finish_reason"] == "length" and budget < max_tokens:
+        token_budgeter.record_truncation(budget_key)
+        truncated = result
+        result = await _complete_openai(prompt, temperature, max_tokens)
+        # Both calls are billed
+        for key in ("tokens_used", "prompt_tokens", "completion_tokens", "latency"):
+            result[key] += truncated[key]
+        token_budgeter.observe(budget_key, result["completion_tokens"] - truncated["completion_tokens"])
+    else:
+        token_budgeter.observe(budget_key, result["completion_tokens"])
+    return result
+
+
+# Helper function to stream a multi-message chat completion
+async def stream_openai_chat(messages: List[Dict[str, str]], temperature: float = 0.7,
+                             max_tokens: int = 500) -> AsyncIterator[Dict[str, Any]]:
+    """Yield {"delta": text} chunks as they arrive, then a final {"usage": {...}} summary"""
+    prompt = render_messages(messages)
+    if cassette.replaying:
+        result = await _replay_openai(prompt)
+        yield {"delta": result["response"]}
+        yield {"usage": {key: value for key, value in result.items() if key != "response"}}
+        return
+
+    parts = []
+    usage = None
+    finish_reason = None
+    try:
+        started = time.perf_counter()
+        stream = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
         )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                yield {"delta": choice.delta.content}
+        latency = time.perf_counter() - started
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    finally:
+        # Stops upstream generation as soon as the consumer goes away
+        await stream.close()
+
+    if cassette.recording:
+        await _record_completion(prompt, temperature, max_tokens, latency, usage,
+                                 [{"content": "".join(parts), "finish_reason": finish_reason}])
+
+    yield {"usage": {
+        "tokens_used": usage.total_tokens,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "latency": round(latency, 4),
+        "model": MODEL
+    }}
+
+
+def _sample_result(choices: List[Dict[str, Any]], prompt_tokens: int, completion_tokens: int,
+                   latency: float, model: str) -> Dict[str, Any]:
+    return {
+        "responses": [choice["content"] for choice in choices],
+        "finish_reasons": [choice["finish_reason"] for choice in choices],
+        "tokens_used": prompt_tokens + completion_tokens,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "latency": round(latency, 4),
+        "model": model
+    }
+
+
+def _samples_key(prompt: str, n: int) -> str:
+    """Cassette key for a multi-sample call; recordings with a different n are not interchangeable"""
+    return f"{prompt}\n[n={n}]"
+
+
+# Helper function to sample several completions of one prompt in a single request
+async def call_openai_samples(prompt: str, n: int, temperature: float = 0.7,
+                              max_tokens: int = 500) -> Dict[str, Any]:
+    """The prompt is billed once; max_tokens applies to each of the n completions"""
+    if cassette.replaying:
+        try:
+            entry = cassette.lookup(_samples_key(prompt, n))
+            if len(entry["choices"]) != n:
+                raise CassetteMiss(f"Recorded completion has {len(entry['choices'])} choices, expected {n}")
+        except CassetteMiss as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI replay error: {str(e)}")
+        if cassette.replay_latency:
+            await await_upstream(asyncio.sleep(entry["latency"]), max_tokens * n)
+        return _sample_result(entry["choices"], entry["prompt_tokens"], entry["completion_tokens"],
+                              entry["latency"], entry["model"])
+
+    try:
+        started = time.perf_counter()
+        response = await await_upstream(client.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=n
+        ), max_tokens * n)
+        latency = time.perf_counter() - started
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+    choices = [
+        {"content": choice.message.content, "finish_reason": choice.finish_reason}
+        for choice in sorted(response.choices, key=lambda choice: choice.index)
+    ]
+    if cassette.recording:
+        await _record_completion(_samples_key(prompt, n), temperature, max_tokens, latency, response.usage, choices)
+
+    return _sample_result(choices, response.usage.prompt_tokens, response.usage.completion_tokens,
+                          latency, MODEL)
 
-        return {
-            "response": response.choices[0].message.content,
-            "tokens_used": response.usage.total_tokens,
-            "model": "gpt-4o-mini"
-        }
+
+# Helper function to stream several completions of one prompt in a single request
+async def stream_openai_samples(prompt: str, n: int, temperature: float = 0.7,
+                                max_tokens: int = 500) -> AsyncIterator[Dict[str, Any]]:
+    """Yield {"index", "delta"} chunks and {"index", "finish_reason"} events per completion, then a
+    final {"usage": {...}} summary. Closing the generator early aborts the upstream stream."""
+    if cassette.replaying:
+        result = await call_openai_samples(prompt, n, temperature, max_tokens)
+        for index, (text, finish_reason) in enumerate(zip(result["responses"], result["finish_reasons"])):
+            yield {"index": index, "delta": text}
+            yield {"index": index, "finish_reason": finish_reason}
+        yield {"usage": {key: value for key, value in result.items()
+                         if key not in ("responses", "finish_reasons")}}
+        return
+
+    parts: List[List[str]] = [[] for _ in range(n)]
+    finish_reasons: List[Optional[str]] = [None] * n
+    usage = None
+    try:
+        started = time.perf_counter()
+        stream = await await_upstream(client.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=n,
+            stream=True,
+            stream_options={"include_usage": True}
+        ), max_tokens * n)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+    try:
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    parts[choice.index].append(choice.delta.content)
+                    yield {"index": choice.index, "delta": choice.delta.content}
+                if choice.finish_reason:
+                    finish_reasons[choice.index] = choice.finish_reason
+                    yield {"index": choice.index, "finish_reason": choice.finish_reason}
+        latency = time.perf_counter() - started
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+    finally:
+        await stream.close()
+
+    choices = [{"content": "".join(text), "finish_reason": reason} for text, reason in zip(parts, finish_reasons)]
+    if cassette.recording:
+        await _record_completion(_samples_key(prompt, n), temperature, max_tokens, latency, usage, choices)
+
+    yield {"usage": {
+        "tokens_used": usage.total_tokens,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "latency": round(latency, 4),
+        "model": MODEL
+    }}
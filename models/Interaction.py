@@ -1,7 +1,8 @@
 
 from typing import Any, Optional, List, Dict, Union
 from pydantic import (
-    BaseModel
+    BaseModel,
+    Field
 )
 # Pydantic models for request/response
 class PromptRequest(BaseModel):
@@ -29,6 +30,10 @@ class ChainOfThoughtRequest(BaseModel):
     problem: str
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = 800
+    # Reasoning paths sampled in one upstream call (the chat completions API allows n <= 128)
+    self_consistency: Optional[int] = Field(None, ge=1, le=128)
+    # Stream the paths and stop once this share of them agrees
+    agreement_threshold: Optional[float] = Field(None, gt=0, le=1)
 
 
 class RoleBasedRequest(BaseModel):
@@ -46,6 +51,15 @@ class PromptResponse(BaseModel):
     model: str
     timestamp: str
 
+
+class SelfConsistencyResponse(PromptResponse):
+    answer: Optional[str]
+    agreement: float
+    answers: List[Optional[str]]
+    samples_requested: int
+    stopped_early: bool
+    tokens_estimated: bool  # tokens_used is a character-count estimate, not billed usage
+
 class ComparisonRequest(BaseModel):
     task: str
     input_text: str
@@ -53,3 +67,9 @@ class ComparisonRequest(BaseModel):
     role: Optional[str] = None
 
 
+class EvaluationRequest(BaseModel):
+    dataset_path: str  # JSONL file under the datasets directory, one {"task_type": "...", ..., "label": "..."} row per line
+    task_types: Optional[List[str]] = None
+    techniques: Optional[List[str]] = None
+    concurrency: int = Field(4, ge=1, le=16)
+    temperature: Optional[float] = 0.0
@@ -1,5 +1,10 @@
 from typing import List, Dict
 
+# Techniques offered by the specialized generators below (anything else falls back to zero_shot)
+SUMMARIZATION_TECHNIQUES = ["zero_shot", "structured", "chain_of_thought", "role_based"]
+CONTENT_TECHNIQUES = ["zero_shot", "constraint_based", "role_based", "template_based"]
+CODE_TECHNIQUES = ["zero_shot", "detailed_specification", "step_by_step", "role_based"]
+
 
 def generate_zero_shot_prompt(task: str, input_text: str) -> str:
     """Generate a zero-shot prompt for the model"""
@@ -43,6 +48,21 @@ Please think through this step by step:
 Let's work through this together:"""
 
 
+def generate_self_consistency_prompt(problem: str) -> str:
+    """Generate a chain-of-thought prompt whose final answer can be extracted and voted on"""
+    return f"""Solve this problem step by step, showing your reasoning clearly:
+
+Problem: {problem}
+
+Please think through this step by step:
+1. First, identify what we know
+2. Then, determine what we need to find
+3. Next, work through the solution methodically
+4. Finally, end with a single line of the form "Final answer: <answer>" containing only the answer
+
+Let's work through this together:"""
+
+
 def generate_role_based_prompt(role: str, task: str, context: str = "") -> str:
     """Generate a role-based prompt with specific persona"""
     context_section = f"\nContext: {context}" if context else ""
@@ -54,6 +74,16 @@ Task: {task}
 Please respond from your expertise and perspective as {role}. Use your specialized knowledge and approach this task as a professional in this field would."""
 
 
+def generate_conversation_summary_prompt(previous_summary: str, transcript: str) -> str:
+    """Generate a prompt that folds older conversation turns into a running summary"""
+    previous_section = f"Summary so far:\n{previous_summary}\n\n" if previous_summary else ""
+
+    return f"""{previous_section}Earlier conversation turns:
+{transcript}
+
+Update the summary so it captures the facts, decisions, open questions and user preferences from the conversation above. Keep it under 150 words and write it in plain prose."""
+
+
 def generate_template_prompt(text: str) -> str:
     """Generate a template-based prompt with structured output"""
     return f"""Please analyze the following text using this structured template:
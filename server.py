@@ -1,8 +1,9 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import aclosing
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from datetime import datetime
-from models.Interaction import PromptResponse, ZeroShotRequest, FewShotRequest,ChainOfThoughtRequest, RoleBasedRequest,PromptRequest, ComparisonRequest
+from models.Interaction import PromptResponse, SelfConsistencyResponse, ZeroShotRequest, FewShotRequest,ChainOfThoughtRequest, RoleBasedRequest,PromptRequest, ComparisonRequest, EvaluationRequest
 from  model_interact.openai_interact import call_openai
 
 from prompt_types.prompt import (generate_zero_shot_prompt,generate_few_shot_prompt,generate_chain_of_thought_prompt,generate_role_based_prompt,generate_template_prompt,generate_advanced_prompt,
@@ -11,8 +12,16 @@ from prompt_types.prompt import (generate_zero_shot_prompt,generate_few_shot_pro
                                  generate_code_generation_prompts,
                                  generate_content_creation_prompts)
 from services.prompt_service import PromptService
+from utils.deadlines import DeadlineMiddleware, cancellation_stats
+from utils.admission import AdmissionController, AdmissionMiddleware
+from utils.token_budget import budget_key, token_budgeter
+from services.evaluation_service import EvaluationService
+from services.session_service import SessionService, SessionError, DEFAULT_SESSION_TASK
 # Initialize services
 prompt_service = PromptService()
+evaluation_service = EvaluationService()
+session_service = SessionService()
+admission_controller = AdmissionController()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -20,6 +29,11 @@ app = FastAPI(
     description="Demonstrate different prompt engineering techniques using GPT-4o-mini",
     version="1.0.0"
 )
+# Per-route concurrency limits with bounded queues; sheds overload with 429 + Retry-After
+app.add_middleware(AdmissionMiddleware, controller=admission_controller)
+# Per-request deadlines (X-Request-Timeout header or route default) and cancellation on disconnect.
+# Added last so it wraps admission and queueing time counts against the deadline.
+app.add_middleware(DeadlineMiddleware)
 #routes starts
 #get
 @app.get("/")
@@ -29,7 +43,7 @@ async def root():
         "endpoints": [
             "/zero-shot", "/few-shot", "/chain-of-thought",
             "/role-based", "/template-prompt", "/advanced-prompt",
-            "/compare-techniques", "/docs"
+            "/compare-techniques", "/evaluate-techniques", "/ws/conversation", "/docs"
         ]
     }
 
@@ -43,7 +57,8 @@ async def zero_shot_prompting(request: ZeroShotRequest):
     """
     prompt = generate_zero_shot_prompt(request.task, request.input_text)
 
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/zero-shot"))
 
     return PromptResponse(
         response=result["response"],
@@ -64,7 +79,8 @@ async def few_shot_prompting(request: FewShotRequest):
         examples=request.examples
     )
 
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/few-shot"))
 
     return PromptResponse(
         response=result["response"],
@@ -75,11 +91,16 @@ async def few_shot_prompting(request: FewShotRequest):
     )
 
 
-@app.post("/chain-of-thought", response_model=PromptResponse)
+@app.post("/chain-of-thought", response_model=Union[SelfConsistencyResponse, PromptResponse])
 async def chain_of_thought_prompting(request: ChainOfThoughtRequest):
-    """Chain-of-thought prompting: Encourage step-by-step reasoning"""
+    """Chain-of-thought prompting: Encourage step-by-step reasoning.
+    With self_consistency=N, N reasoning paths are sampled in one call and majority-voted."""
+    if request.self_consistency is not None:
+        return await prompt_service.self_consistency(request)
+
     prompt = generate_chain_of_thought_prompt(request.problem)
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/chain-of-thought"))
 
     return PromptResponse(
         response=result["response"],
@@ -94,7 +115,8 @@ async def chain_of_thought_prompting(request: ChainOfThoughtRequest):
 async def role_based_prompting(request: RoleBasedRequest):
     """Role-based prompting: Give the model a specific persona/expertise"""
     prompt = generate_role_based_prompt(request.role, request.task, request.context)
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/role-based"))
 
     return PromptResponse(
         response=result["response"],
@@ -109,7 +131,8 @@ async def role_based_prompting(request: RoleBasedRequest):
 async def template_prompting(request: PromptRequest):
     """Template-based prompting: Structured format with clear sections"""
     prompt = generate_template_prompt(request.text)
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/template-prompt"))
 
     return PromptResponse(
         response=result["response"],
@@ -124,7 +147,8 @@ async def template_prompting(request: PromptRequest):
 async def advanced_prompting(request: PromptRequest):
     """Advanced prompting: Combines multiple techniques"""
     prompt = generate_advanced_prompt(request.text)
-    result = await call_openai(prompt, request.temperature, request.max_tokens)
+    result = await call_openai(prompt, request.temperature, request.max_tokens,
+                               budget_key(request, "/advanced-prompt"))
 
     return PromptResponse(
         response=result["response"],
@@ -141,6 +165,42 @@ async def compare_prompting_techniques(request: ComparisonRequest):
     return await prompt_service.compare_techniques(request)
 
 
+@app.post("/evaluate-techniques")
+async def evaluate_prompting_techniques(request: EvaluationRequest):
+    """Run every technique variant over a labeled dataset and report accuracy, tokens and latency"""
+    return await evaluation_service.evaluate(request)
+
+
+@app.websocket("/ws/conversation")
+async def conversation_session(websocket: WebSocket, role: str, task: str = DEFAULT_SESSION_TASK,
+                               context: str = "", session_id: Optional[str] = None,
+                               temperature: float = 0.7, max_tokens: int = 500):
+    """Multi-turn conversation with server-side, token-bounded history and streamed replies"""
+    await websocket.accept()
+    try:
+        session = session_service.open(session_id, role, task, context)
+    except SessionError as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+    await websocket.send_json({"type": "session", "session_id": session.session_id})
+
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                # Closing the reply promptly releases the session lock and the upstream stream
+                # if sending fails mid-reply
+                async with aclosing(session_service.reply(session, message, temperature, max_tokens)) as events:
+                    async for event in events:
+                        await websocket.send_json(event)
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail})
+    except WebSocketDisconnect:
+        # The session stays resumable by id until it idles out
+        pass
+
+
 @app.post("/sentiment-analysis")
 async def sentiment_analysis_demo(text: str, technique: str = "zero_shot"):
     """Demonstrate sentiment analysis with different prompting techniques"""
@@ -187,7 +247,15 @@ async def summarization_examples():
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "model": "gpt-4o-mini", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "model": "gpt-4o-mini",
+        "sessions": session_service.stats(),
+        "cancellation": cancellation_stats.snapshot(),
+        "admission": admission_controller.stats(),
+        "token_budgets": token_budgeter.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
 
 
 # if __name__ == "__main__":
@@ -221,6 +289,14 @@ POST /chain-of-thought
     "problem": "A store has 150 apples. They sell 60% in the morning and 25% of the remainder in the afternoon. How many apples are left?"
 }
 
+# 4b. Chain-of-thought with self-consistency (5 paths in one call, stop once 60% agree)
+POST /chain-of-thought
+{
+    "problem": "A store has 150 apples. They sell 60% in the morning and 25% of the remainder in the afternoon. How many apples are left?",
+    "self_consistency": 5,
+    "agreement_threshold": 0.6
+}
+
 # 5. Role-based prompting
 POST /role-based
 {
@@ -240,6 +316,21 @@ POST /compare-techniques
     "role": "product manager"
 }
 
+# 6b. Evaluate techniques over a labeled dataset (JSONL, one row per line)
+# {"task_type": "sentiment", "text": "Worst purchase ever", "label": "negative"}
+POST /evaluate-techniques
+{
+    "dataset_path": "sentiment.jsonl",
+    "concurrency": 8
+}
+
+# 6c. Conversational session (WebSocket)
+WS /ws/conversation?role=experienced%20travel%20agent
+-> {"type": "session", "session_id": "..."}
+<- "Plan a 3-day trip to Lisbon"
+-> {"type": "delta", "content": "..."} ... {"type": "done", "tokens_used": ..., "history_tokens": ...}
+Reconnect with the issued ?session_id=... (and the same role/task/context) to resume the conversation.
+
 # 7. Sentiment analysis demo
 POST /sentiment-analysis?technique=chain_of_thought
 Body: "I'm really disappointed with this purchase, but the customer service was helpful"
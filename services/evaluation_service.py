@@ -0,0 +1,211 @@
+# ================================================================
+# services/evaluation_service.py
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from models.Interaction import EvaluationRequest
+from model_interact.openai_interact import call_openai
+from prompt_types.prompt import (generate_sentiment_prompts,
+                                 generate_summarization_prompts,
+                                 generate_code_generation_prompts,
+                                 generate_content_creation_prompts,
+                                 SUMMARIZATION_TECHNIQUES,
+                                 CONTENT_TECHNIQUES,
+                                 CODE_TECHNIQUES)
+
+# Technique variants offered by each specialized prompt generator
+TASK_TECHNIQUES: Dict[str, List[str]] = {
+    "sentiment": ["zero_shot", "few_shot", "chain_of_thought", "role_based"],
+    "summarization": SUMMARIZATION_TECHNIQUES,
+    "content": CONTENT_TECHNIQUES,
+    "code": CODE_TECHNIQUES,
+}
+
+# Render a dataset row into the prompt for a given technique
+PROMPT_RENDERERS: Dict[str, Callable[[Dict[str, Any], str], str]] = {
+    "sentiment": lambda row, technique: generate_sentiment_prompts(row["text"])[technique],
+    "summarization": lambda row, technique: generate_summarization_prompts(
+        row["text"], technique, row.get("summary_length", "medium")),
+    "content": lambda row, technique: generate_content_creation_prompts(
+        row["topic"], row["content_type"], technique, row.get("target_audience", "general")),
+    "code": lambda row, technique: generate_code_generation_prompts(row["task"], row["language"], technique),
+}
+
+# Same completion ceilings as the PromptService demo endpoints
+TASK_MAX_TOKENS: Dict[str, int] = {"code": 800}
+
+# Datasets can only be read from this directory
+DATASETS_DIR = os.environ.get("EVALUATION_DATASETS_DIR", "datasets")
+
+# Explicit answer line, e.g. "Final sentiment: Negative" or "- Primary sentiment (1-10): **positive**"
+ANSWER_LINE_PATTERN = r"(?:sentiment|classification|answer|label|category)\s*(?:\([^)]*\))?\s*[:=\-→]+\s*\**\s*"
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percentile / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def extract_label(response: str, labels: List[str]) -> Optional[str]:
+    """Final classification of a completion among the known labels.
+
+    An explicit answer line wins (the last one if several); otherwise the completion must
+    mention exactly one of the labels. Ambiguous completions have no classification.
+    """
+    alternatives = "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True))
+    answers = re.findall(rf"{ANSWER_LINE_PATTERN}\b({alternatives})\b", response, re.IGNORECASE)
+    if answers:
+        return answers[-1].lower()
+
+    mentioned = {match.lower() for match in re.findall(rf"\b({alternatives})\b", response, re.IGNORECASE)}
+    return mentioned.pop() if len(mentioned) == 1 else None
+
+
+def resolve_dataset_path(path: str) -> str:
+    """Resolve a dataset path inside DATASETS_DIR, rejecting anything outside it"""
+    base = os.path.realpath(DATASETS_DIR)
+    resolved = os.path.realpath(os.path.join(base, path))
+    if os.path.commonpath([base, resolved]) != base:
+        raise HTTPException(status_code=400, detail=f"dataset_path must be inside the {DATASETS_DIR} directory")
+    return resolved
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    """Load a labeled dataset from a JSONL file under DATASETS_DIR"""
+    try:
+        with open(resolve_dataset_path(path), encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    except (OSError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not load dataset: {str(e)}")
+
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            raise HTTPException(status_code=400, detail=f"Row {index}: must be a JSON object")
+        if row.get("label") is not None and not isinstance(row["label"], str):
+            raise HTTPException(status_code=400, detail=f"Row {index}: label must be a string")
+        if row.get("task_type") not in TASK_TECHNIQUES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Row {index}: task_type must be one of: {list(TASK_TECHNIQUES.keys())}"
+            )
+    return rows
+
+
+class EvaluationService:
+    """Run every technique variant over a labeled dataset and aggregate the results"""
+
+    async def evaluate(self, request: EvaluationRequest) -> Dict[str, Any]:
+        """Evaluate the technique matrix over the dataset with bounded concurrency"""
+        rows = load_dataset(request.dataset_path)
+        if request.task_types:
+            rows = [row for row in rows if row["task_type"] in request.task_types]
+
+        semaphore = asyncio.Semaphore(request.concurrency)
+        # Identical rendered prompts share one upstream call
+        calls: Dict[str, asyncio.Task] = {}
+
+        async def run_prompt(prompt: str, max_tokens: int, key: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await call_openai(prompt, request.temperature, max_tokens, budget_key=key)
+
+        async def run_case(row: Dict[str, Any], technique: str) -> Dict[str, Any]:
+            task_type = row["task_type"]
+            case = {"task_type": task_type, "technique": technique, "label": row.get("label")}
+            try:
+                prompt = PROMPT_RENDERERS[task_type](row, technique)
+            except KeyError as e:
+                case["error"] = f"Missing field {str(e)}"
+                return case
+
+            # Only the case that issued a shared call is billed for it
+            case["shared"] = prompt in calls
+            if not case["shared"]:
+                max_tokens = TASK_MAX_TOKENS.get(task_type, 500)
+                calls[prompt] = asyncio.create_task(run_prompt(prompt, max_tokens, f"{task_type}:{technique}"))
+            try:
+                case["result"] = await calls[prompt]
+            except HTTPException as e:
+                case["error"] = e.detail
+            return case
+
+        cases = [
+            run_case(row, technique)
+            for row in rows
+            for technique in TASK_TECHNIQUES[row["task_type"]]
+            if not request.techniques or technique in request.techniques
+        ]
+        results = await asyncio.gather(*cases)
+
+        # Every label seen for a task type is a candidate classification for its completions
+        labels: Dict[str, set] = {}
+        for row in rows:
+            if row.get("label"):
+                labels.setdefault(row["task_type"], set()).add(row["label"].strip().lower())
+
+        return {
+            "dataset": request.dataset_path,
+            "rows": len(rows),
+            "upstream_calls": len(calls),
+            "report": self.aggregate(results, labels),
+            "timestamp": datetime.now().isoformat()
+        }
+
+    def aggregate(self, results: List[Dict[str, Any]], labels: Dict[str, set]) -> Dict[str, Any]:
+        """Aggregate accuracy, token usage and latency percentiles per task type and technique"""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for case in results:
+            groups.setdefault(f"{case['task_type']}/{case['technique']}", []).append(case)
+
+        report = {}
+        for name, cases in groups.items():
+            completed = [case for case in cases if "result" in case]
+            labeled = [case for case in completed if case["label"]]
+            correct = sum(
+                extract_label(case["result"]["response"], list(labels[case["task_type"]]))
+                == case["label"].strip().lower()
+                for case in labeled
+            )
+            # Token and latency figures cover distinct upstream calls, so they add up to what was billed
+            billed = [case for case in completed if not case["shared"]]
+            latencies = [case["result"]["latency"] for case in billed]
+            prompt_tokens = sum(case["result"]["prompt_tokens"] for case in billed)
+            completion_tokens = sum(case["result"]["completion_tokens"] for case in billed)
+
+            report[name] = {
+                "cases": len(cases),
+                "errors": len(cases) - len(completed),
+                "labeled": len(labeled),
+                "upstream_calls": len(billed),
+                "accuracy": correct / len(labeled) if labeled else None,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "avg_completion_tokens": completion_tokens / len(billed) if billed else None,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p90": _percentile(latencies, 90),
+                "latency_p99": _percentile(latencies, 99),
+            }
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate prompting techniques over a labeled dataset")
+    parser.add_argument("dataset_path", help=f"JSONL file relative to {DATASETS_DIR}")
+    parser.add_argument("--task-types", nargs="*")
+    parser.add_argument("--techniques", nargs="*")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    args = parser.parse_args()
+
+    report = asyncio.run(EvaluationService().evaluate(EvaluationRequest(**vars(args))))
+    print(json.dumps(report, indent=2))
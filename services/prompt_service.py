@@ -1,41 +1,86 @@
 # ================================================================
 # services/prompt_service.py
+import asyncio
+import re
+from collections import Counter
 from fastapi import HTTPException
 from datetime import datetime
-from typing import Dict, Any
-from models.Interaction import PromptResponse, ComparisonRequest
-from model_interact.openai_interact import call_openai
+from typing import Dict, Any, List, Optional
+from models.Interaction import PromptResponse, ComparisonRequest, ChainOfThoughtRequest, SelfConsistencyResponse
+from model_interact.openai_interact import MODEL, call_openai, call_openai_samples, stream_openai_samples
 from prompt_types.prompt import (generate_zero_shot_prompt,generate_few_shot_prompt,generate_chain_of_thought_prompt,generate_role_based_prompt,generate_template_prompt,generate_advanced_prompt,
                                  generate_summarization_prompts,
                                  generate_sentiment_prompts,
                                  generate_code_generation_prompts,
-                                 generate_content_creation_prompts)
+                                 generate_content_creation_prompts,
+                                 generate_self_consistency_prompt,
+                                 SUMMARIZATION_TECHNIQUES,
+                                 CONTENT_TECHNIQUES,
+                                 CODE_TECHNIQUES)
+from utils.tokens import estimate_tokens
+
+FINAL_ANSWER_PATTERN = re.compile(r"final answer\s*[:\-]\s*(.+)", re.IGNORECASE)
+
+
+def extract_final_answer(text: str) -> Optional[str]:
+    """Pull the final answer out of a reasoning path, normalized so equivalent answers vote together"""
+    matches = FINAL_ANSWER_PATTERN.findall(text or "")
+    if matches:
+        answer = matches[-1]
+    else:
+        lines = [line for line in (text or "").splitlines() if line.strip()]
+        answer = lines[-1] if lines else ""
+
+    answer = answer.strip().strip("*").strip().rstrip(".").lower()
+    answer = re.sub(r"(?<=\d),(?=\d{3})", "", answer)
+    answer = re.sub(r"\s+", " ", answer).strip("$ ")
+    return answer or None
+
+
+def _check_technique(technique: str, techniques: List[str]) -> None:
+    if technique not in techniques:
+        raise HTTPException(status_code=400, detail=f"Technique must be one of: {techniques}")
+
+
+def _vote(answers: List[Optional[str]]) -> Optional[tuple]:
+    """Most common extracted answer and its vote count"""
+    votes = Counter(answer for answer in answers if answer)
+    return votes.most_common(1)[0] if votes else None
 
 
 class PromptService:
     """Service class for handling different prompt engineering tasks"""
 
+    async def _fan_out(self, prompts: Dict[str, str]) -> Dict[str, Any]:
+        """Run the prompts concurrently; if one fails or the request is cancelled, cancel the rest"""
+        tasks = {name: asyncio.ensure_future(call_openai(prompt, budget_key=f"compare:{name}")) for name, prompt in prompts.items()}
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
     async def compare_techniques(self, request: ComparisonRequest) -> Dict[str, Any]:
         """Compare different prompting techniques on the same task"""
-        results = {}
+        prompts = {}
 
         # Zero-shot
-        zero_shot_prompt = generate_zero_shot_prompt(request.task, request.input_text)
-        results["zero_shot"] = await call_openai(zero_shot_prompt)
+        prompts["zero_shot"] = generate_zero_shot_prompt(request.task, request.input_text)
 
         # Few-shot (if examples provided)
         if request.examples:
-            few_shot_prompt = generate_few_shot_prompt(request.task, request.input_text, request.examples)
-            results["few_shot"] = await call_openai(few_shot_prompt)
+            prompts["few_shot"] = generate_few_shot_prompt(request.task, request.input_text, request.examples)
 
         # Chain-of-thought
-        cot_prompt = generate_chain_of_thought_prompt(f"Task: {request.task}\nInput: {request.input_text}")
-        results["chain_of_thought"] = await call_openai(cot_prompt)
+        prompts["chain_of_thought"] = generate_chain_of_thought_prompt(f"Task: {request.task}\nInput: {request.input_text}")
 
         # Role-based (if role provided)
         if request.role:
-            role_prompt = generate_role_based_prompt(request.role, f"{request.task}\nInput: {request.input_text}")
-            results["role_based"] = await call_openai(role_prompt)
+            prompts["role_based"] = generate_role_based_prompt(request.role, f"{request.task}\nInput: {request.input_text}")
+
+        results = await self._fan_out(prompts)
 
         return {
             "comparison_results": results,
@@ -45,6 +90,75 @@ class PromptService:
             "techniques_compared": list(results.keys())
         }
 
+    async def self_consistency(self, request: ChainOfThoughtRequest) -> SelfConsistencyResponse:
+        """Sample several reasoning paths in one upstream call and return the majority answer"""
+        n = request.self_consistency
+        threshold = request.agreement_threshold
+
+        prompt = generate_self_consistency_prompt(request.problem)
+        stopped_early = False
+        tokens_estimated = False
+
+        if threshold is None:
+            result = await call_openai_samples(prompt, n, request.temperature, request.max_tokens)
+            responses = result["responses"]
+            # Paths cut off by max_tokens never reached an answer
+            answers = [
+                extract_final_answer(text) if reason != "length" else None
+                for text, reason in zip(responses, result["finish_reasons"])
+            ]
+        else:
+            texts: List[List[str]] = [[] for _ in range(n)]
+            answers = [None] * n
+            finished = 0
+            result = None
+            stream = stream_openai_samples(prompt, n, request.temperature, request.max_tokens)
+            try:
+                async for event in stream:
+                    if "delta" in event:
+                        texts[event["index"]].append(event["delta"])
+                    elif "finish_reason" in event:
+                        finished += 1
+                        if event["finish_reason"] != "length":
+                            answers[event["index"]] = extract_final_answer("".join(texts[event["index"]]))
+                        leader = _vote(answers)
+                        if finished < n and leader and leader[1] / n >= threshold:
+                            stopped_early = True
+                            break
+                    else:
+                        result = event["usage"]
+            finally:
+                await stream.aclose()
+
+            responses = ["".join(text) for text in texts]
+            if result is None:
+                # The upstream only reports usage at the end of a stream; estimate what was generated
+                prompt_tokens = estimate_tokens(prompt)
+                completion_tokens = sum(estimate_tokens(text) for text in responses if text)
+                result = {"tokens_used": prompt_tokens + completion_tokens, "model": MODEL}
+                tokens_estimated = True
+
+        leader = _vote(answers)
+        answer, votes = leader if leader else (None, 0)
+        # Agreement is measured over the paths that actually came back
+        returned = len(responses)
+        response = next((text for text, path_answer in zip(responses, answers)
+                         if answer and path_answer == answer), responses[0])
+
+        return SelfConsistencyResponse(
+            response=response,
+            prompt_used=prompt,
+            tokens_used=result["tokens_used"],
+            model=result["model"],
+            timestamp=datetime.now().isoformat(),
+            answer=answer,
+            agreement=votes / returned if returned else 0.0,
+            answers=answers,
+            samples_requested=n,
+            stopped_early=stopped_early,
+            tokens_estimated=tokens_estimated
+        )
+
     async def sentiment_analysis(self, text: str, technique: str) -> PromptResponse:
         """Perform sentiment analysis using specified technique"""
         techniques = generate_sentiment_prompts(text)
@@ -52,7 +166,7 @@ class PromptService:
         if technique not in techniques:
             raise HTTPException(status_code=400, detail=f"Technique must be one of: {list(techniques.keys())}")
 
-        result = await call_openai(techniques[technique])
+        result = await call_openai(techniques[technique], budget_key=f"sentiment:{technique}")
 
         return PromptResponse(
             response=result["response"],
@@ -64,8 +178,9 @@ class PromptService:
 
     async def text_summarization(self, text: str, technique: str, summary_length: str) -> PromptResponse:
         """Perform text summarization using specified technique"""
+        _check_technique(technique, SUMMARIZATION_TECHNIQUES)
         prompt = generate_summarization_prompts(text, technique, summary_length)
-        result = await call_openai(prompt)
+        result = await call_openai(prompt, budget_key=f"summarization:{technique}")
 
         return PromptResponse(
             response=result["response"],
@@ -78,8 +193,9 @@ class PromptService:
     async def content_generation(self, topic: str, content_type: str, technique: str,
                                  target_audience: str) -> PromptResponse:
         """Generate content using specified technique"""
+        _check_technique(technique, CONTENT_TECHNIQUES)
         prompt = generate_content_creation_prompts(topic, content_type, technique, target_audience)
-        result = await call_openai(prompt)
+        result = await call_openai(prompt, budget_key=f"content:{technique}")
 
         return PromptResponse(
             response=result["response"],
@@ -91,8 +207,9 @@ class PromptService:
 
     async def code_generation(self, task: str, language: str, technique: str) -> PromptResponse:
         """Generate code using specified technique"""
+        _check_technique(technique, CODE_TECHNIQUES)
         prompt = generate_code_generation_prompts(task, language, technique)
-        result = await call_openai(prompt, max_tokens=800)
+        result = await call_openai(prompt, max_tokens=800, budget_key=f"code:{technique}")
 
         return PromptResponse(
             response=result["response"],
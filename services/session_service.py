@@ -0,0 +1,167 @@
+# ================================================================
+# services/session_service.py
+import asyncio
+import time
+import uuid
+from contextlib import aclosing
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from model_interact.openai_interact import call_openai, stream_openai_chat
+from prompt_types.prompt import generate_role_based_prompt, generate_conversation_summary_prompt
+from utils.tokens import estimate_tokens
+
+DEFAULT_SESSION_TASK = "Hold a helpful conversation with the user and answer their questions"
+
+
+class SessionError(LookupError):
+    """Raised when a client asks to resume a session it cannot use"""
+
+
+class ConversationSession:
+    """Server-side state of one conversation: persona, running summary and recent turns"""
+
+    __slots__ = ("session_id", "system_prompt", "summary", "turns", "history_tokens", "last_active", "lock")
+
+    def __init__(self, session_id: str, system_prompt: str):
+        self.session_id = session_id
+        self.system_prompt = system_prompt
+        self.summary = ""
+        # (role, content, estimated tokens)
+        self.turns: Deque[Tuple[str, str, int]] = deque()
+        self.history_tokens = 0
+        self.last_active = time.monotonic()
+        # Serializes replies when several sockets share the session
+        self.lock = asyncio.Lock()
+
+    def add_turn(self, role: str, content: str) -> None:
+        tokens = estimate_tokens(content)
+        self.turns.append((role, content, tokens))
+        self.history_tokens += tokens
+
+    def pop_turn(self) -> Tuple[str, str, int]:
+        turn = self.turns.popleft()
+        self.history_tokens -= turn[2]
+        return turn
+
+    def pop_last_turn(self) -> Tuple[str, str, int]:
+        turn = self.turns.pop()
+        self.history_tokens -= turn[2]
+        return turn
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Chat messages sent upstream: persona (plus summary) followed by the recent window"""
+        system = self.system_prompt
+        if self.summary:
+            system = f"{system}\n\nSummary of the earlier conversation:\n{self.summary}"
+        return [{"role": "system", "content": system}] + [
+            {"role": role, "content": content} for role, content, _ in self.turns
+        ]
+
+
+class SessionService:
+    """Keeps bounded per-session conversation state for WebSocket clients"""
+
+    def __init__(self, history_token_budget: int = 2000, window_ratio: float = 0.5,
+                 idle_ttl: float = 900.0, max_sessions: int = 10000):
+        self.history_token_budget = history_token_budget
+        # Once over budget, older turns are summarized until the window fits in this share of it
+        self.window_tokens = int(history_token_budget * window_ratio)
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        # Ordered from least to most recently active
+        self.sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+
+    def open(self, session_id: Optional[str], role: str, task: str = DEFAULT_SESSION_TASK,
+             context: str = "") -> ConversationSession:
+        """Start a new session with a role-based persona, or resume one this server issued"""
+        self.evict_idle()
+        system_prompt = generate_role_based_prompt(role, task, context)
+        if session_id:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise SessionError("Unknown or expired session_id")
+            if session.system_prompt != system_prompt:
+                raise SessionError("Session was started with a different role, task or context")
+        else:
+            session = ConversationSession(uuid.uuid4().hex, system_prompt)
+            self.sessions[session.session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.touch(session)
+        return session
+
+    def touch(self, session: ConversationSession) -> None:
+        session.last_active = time.monotonic()
+        if session.session_id in self.sessions:
+            self.sessions.move_to_end(session.session_id)
+
+    def evict_idle(self) -> int:
+        """Drop sessions idle for longer than the TTL; returns how many were evicted"""
+        cutoff = time.monotonic() - self.idle_ttl
+        evicted = 0
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_active > cutoff:
+                break
+            self.sessions.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    async def compact(self, session: ConversationSession) -> None:
+        """Fold the oldest turns into the running summary once history exceeds its token budget"""
+        if session.history_tokens <= self.history_token_budget:
+            return
+
+        # Pick the oldest turns to fold, always keeping the latest exchange verbatim
+        folded = []
+        remaining_tokens = session.history_tokens
+        for role, content, tokens in session.turns:
+            if remaining_tokens <= self.window_tokens or len(session.turns) - len(folded) <= 2:
+                break
+            folded.append(f"{role}: {content}")
+            remaining_tokens -= tokens
+
+        if folded:
+            prompt = generate_conversation_summary_prompt(session.summary, "\n".join(folded))
+            result = await call_openai(prompt, temperature=0.3, max_tokens=250)
+            # Only drop the turns once they are safely in the summary
+            for _ in folded:
+                session.pop_turn()
+            session.summary = result["response"]
+
+    async def reply(self, session: ConversationSession, message: str, temperature: float = 0.7,
+                    max_tokens: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the assistant's reply to a user message, then record both turns"""
+        async with session.lock:
+            self.touch(session)
+            session.add_turn("user", message)
+
+            parts = []
+            usage: Dict[str, Any] = {}
+            try:
+                await self.compact(session)
+                async with aclosing(stream_openai_chat(session.messages(), temperature, max_tokens)) as events:
+                    async for event in events:
+                        if "delta" in event:
+                            parts.append(event["delta"])
+                            yield {"type": "delta", "content": event["delta"]}
+                        else:
+                            usage = event["usage"]
+            except BaseException:
+                # Leave the history as it was so the client can retry the message
+                session.pop_last_turn()
+                raise
+
+            session.add_turn("assistant", "".join(parts))
+            self.touch(session)
+            yield {
+                "type": "done",
+                "session_id": session.session_id,
+                "history_tokens": session.history_tokens,
+                "summarized": bool(session.summary),
+                **usage
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active_sessions": len(self.sessions), "history_token_budget": self.history_token_budget}
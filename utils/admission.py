@@ -0,0 +1,154 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+from utils.deadlines import remaining_time
+
+# Routes that fan out or run long are admitted as "batch"; every other POST is "interactive"
+ROUTE_CLASSES: Dict[str, str] = {
+    "/compare-techniques": "batch",
+    "/evaluate-techniques": "batch",
+}
+# Concurrent requests and bounded wait queue per admission class
+CLASS_LIMITS: Dict[str, Dict[str, int]] = {
+    "interactive": {"concurrency": 32, "max_queue": 64},
+    "batch": {"concurrency": 4, "max_queue": 8},
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of queued"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionClass:
+    """Concurrency limit with a bounded FIFO wait queue and a service-time estimate"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, smoothing: float = 0.2):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.smoothing = smoothing
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.avg_service_time: Optional[float] = None
+        self.admitted = 0
+        self.shed = 0
+
+    def estimated_wait(self, position: int) -> float:
+        """Expected seconds until the request at this queue position gets a slot"""
+        if self.avg_service_time is None:
+            return 0.0
+        return (position // self.concurrency + 1) * self.avg_service_time
+
+    def _reject(self, reason: str, wait: float) -> AdmissionRejected:
+        self.shed += 1
+        return AdmissionRejected(reason, max(1, math.ceil(wait)))
+
+    async def acquire(self, deadline_remaining: Optional[float] = None) -> None:
+        """Take a slot, queueing if needed; raises AdmissionRejected when the request should be shed"""
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        position = len(self.waiters)
+        wait = self.estimated_wait(position)
+        if position >= self.max_queue:
+            raise self._reject(f"{self.name} queue is full", wait)
+        if deadline_remaining is not None and wait > deadline_remaining:
+            raise self._reject(f"Estimated {self.name} queue wait exceeds the request deadline", wait)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as we were cancelled; pass it on
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Free a slot, handing it straight to the next waiter if there is one"""
+        if service_time is not None:
+            if self.avg_service_time is None:
+                self.avg_service_time = service_time
+            else:
+                self.avg_service_time += self.smoothing * (service_time - self.avg_service_time)
+
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queue_depth": len(self.waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_service_time": None if self.avg_service_time is None else round(self.avg_service_time, 3),
+        }
+
+
+class AdmissionController:
+    """Maps routes to admission classes"""
+
+    def __init__(self, class_limits: Optional[Dict[str, Dict[str, int]]] = None,
+                 route_classes: Optional[Dict[str, str]] = None, default_class: str = "interactive"):
+        limits = CLASS_LIMITS if class_limits is None else class_limits
+        self.classes = {name: AdmissionClass(name, **config) for name, config in limits.items()}
+        self.route_classes = ROUTE_CLASSES if route_classes is None else route_classes
+        self.default_class = default_class
+
+    def class_for(self, path: str) -> AdmissionClass:
+        return self.classes[self.route_classes.get(path, self.default_class)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: admission_class.stats() for name, admission_class in self.classes.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware that admits, queues or sheds POST requests with 429 + Retry-After"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        admission_class = self.controller.class_for(scope["path"])
+        try:
+            await admission_class.acquire(remaining_time())
+        except AdmissionRejected as e:
+            response = JSONResponse({"detail": f"Server overloaded: {e.reason}"}, status_code=429,
+                                    headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        service_time = None
+        try:
+            await self.app(scope, receive, send)
+            service_time = time.perf_counter() - started
+        finally:
+            admission_class.release(service_time)
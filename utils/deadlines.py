@@ -0,0 +1,173 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Optional, TypeVar
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = b"x-request-timeout"
+DEFAULT_TIMEOUT = 30.0
+# Per-route deadlines in seconds; None means no deadline unless the client sends one
+ROUTE_TIMEOUTS: Dict[str, Optional[float]] = {
+    "/compare-techniques": 60.0,
+    "/evaluate-techniques": 300.0,
+}
+
+# Absolute time.monotonic() deadline of the request being handled
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without a deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CancellationStats:
+    """Counts upstream work abandoned because of deadlines or client disconnects.
+
+    Savings are estimated from the running averages of completed calls: a cancelled call
+    would have produced about the average completion (capped at its max_tokens) and would
+    have run for about the average latency.
+    """
+
+    def __init__(self, smoothing: float = 0.1):
+        self.smoothing = smoothing
+        self.avg_completion_tokens: Optional[float] = None
+        self.avg_latency: Optional[float] = None
+        self.requests_timed_out = 0
+        self.requests_disconnected = 0
+        self.calls_cancelled = 0
+        self.tokens_saved = 0.0
+        self.seconds_saved = 0.0
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else current + self.smoothing * (value - current)
+
+    def observe(self, completion_tokens: int, latency: float) -> None:
+        """Record a completed upstream call"""
+        self.avg_completion_tokens = self._ewma(self.avg_completion_tokens, completion_tokens)
+        self.avg_latency = self._ewma(self.avg_latency, latency)
+
+    def record_cancelled(self, max_tokens: int, elapsed: float) -> None:
+        """Record an upstream call abandoned after `elapsed` seconds"""
+        self.calls_cancelled += 1
+        expected_tokens = max_tokens if self.avg_completion_tokens is None else self.avg_completion_tokens
+        self.tokens_saved += min(max_tokens, expected_tokens)
+        if self.avg_latency is not None:
+            self.seconds_saved += max(0.0, self.avg_latency - elapsed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests_timed_out": self.requests_timed_out,
+            "requests_disconnected": self.requests_disconnected,
+            "upstream_calls_cancelled": self.calls_cancelled,
+            "estimated_tokens_saved": round(self.tokens_saved),
+            "estimated_seconds_saved": round(self.seconds_saved, 3),
+        }
+
+
+cancellation_stats = CancellationStats()
+
+
+async def await_upstream(call: Awaitable[T], max_tokens: int) -> T:
+    """Await an upstream call within the current request's deadline"""
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        if asyncio.iscoroutine(call):
+            call.close()
+        raise HTTPException(status_code=504, detail="Request deadline exceeded")
+
+    started = time.perf_counter()
+    try:
+        return await asyncio.wait_for(call, remaining)
+    except asyncio.TimeoutError:
+        cancellation_stats.record_cancelled(max_tokens, time.perf_counter() - started)
+        raise HTTPException(status_code=504, detail="Request deadline exceeded waiting for OpenAI")
+    except asyncio.CancelledError:
+        cancellation_stats.record_cancelled(max_tokens, time.perf_counter() - started)
+        raise
+
+
+class DeadlineMiddleware:
+    """ASGI middleware enforcing per-request deadlines and cancelling work on client disconnect.
+
+    The deadline comes from the X-Request-Timeout header (seconds) or the route default, and
+    is published through a context variable so upstream calls can honour it. The handler runs
+    in its own task, which is cancelled when the deadline passes or the client goes away.
+    """
+
+    def __init__(self, app, default_timeout: Optional[float] = DEFAULT_TIMEOUT,
+                 route_timeouts: Optional[Dict[str, Optional[float]]] = None):
+        self.app = app
+        self.default_timeout = default_timeout
+        self.route_timeouts = ROUTE_TIMEOUTS if route_timeouts is None else route_timeouts
+
+    def _timeout(self, scope) -> Optional[float]:
+        for name, value in scope["headers"]:
+            if name == DEADLINE_HEADER:
+                try:
+                    return max(0.0, float(value))
+                except ValueError:
+                    break
+        return self.route_timeouts.get(scope["path"], self.default_timeout)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timeout = self._timeout(scope)
+        messages: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def pump_receive():
+            # Keep reading so a disconnect is seen even after the body has been consumed
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        async def app_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        token = _deadline.set(None if timeout is None else time.monotonic() + timeout)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, messages.get, app_send))
+        finally:
+            _deadline.reset(token)
+        pump_task = asyncio.ensure_future(pump_receive())
+        disconnect_task = asyncio.ensure_future(disconnected.wait())
+
+        try:
+            done, _ = await asyncio.wait({app_task, disconnect_task}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+
+            if disconnect_task in done:
+                cancellation_stats.requests_disconnected += 1
+            else:
+                cancellation_stats.requests_timed_out += 1
+            app_task.cancel()
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                pass
+
+            if not disconnected.is_set() and not response_started:
+                response = JSONResponse({"detail": "Request deadline exceeded"}, status_code=504)
+                await response(scope, messages.get, send)
+        finally:
+            for task in (app_task, pump_task, disconnect_task):
+                task.cancel()
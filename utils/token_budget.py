@@ -0,0 +1,138 @@
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class P2Quantile:
+    """Streaming quantile estimate in constant memory (Jain & Chlamtac's P-square algorithm)"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float) -> None:
+        self.count += 1
+        if self.count <= 5:
+            self.heights.append(x)
+            self.heights.sort()
+            return
+
+        h, n = self.heights, self.positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if h[i] <= x < h[i + 1])
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                q = self._parabolic(i, step)
+                if not h[i - 1] < q < h[i + 1]:
+                    q = self._linear(i, step)
+                h[i] = q
+                n[i] += step
+
+    def _parabolic(self, i: int, d: int) -> float:
+        h, n = self.heights, self.positions
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def _linear(self, i: int, d: int) -> float:
+        h, n = self.heights, self.positions
+        return h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+
+    def value(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return self.heights[max(0, math.ceil(self.p * self.count) - 1)]
+        return self.heights[2]
+
+
+class TokenBudgeter:
+    """Learns completion-length distributions per route/technique and sizes max_tokens from them.
+
+    Once a key has enough samples, its budget is the tracked high percentile times a safety
+    margin, never above the caller's ceiling. Disabled budgeting always returns the ceiling.
+    """
+
+    def __init__(self, enabled: bool = False, quantile: float = 0.95, margin: float = 1.25,
+                 min_samples: int = 20, floor: int = 64, max_keys: int = 256):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.floor = floor
+        # Upper bound on tracked route/technique keys
+        self.max_keys = max_keys
+        self.sketches: Dict[str, P2Quantile] = {}
+        self.truncations: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> "TokenBudgeter":
+        """Build a budgeter from ADAPTIVE_MAX_TOKENS* environment variables"""
+        return cls(
+            enabled=os.environ.get("ADAPTIVE_MAX_TOKENS", "false").lower() in ("1", "true", "yes"),
+            quantile=float(os.environ.get("ADAPTIVE_MAX_TOKENS_QUANTILE", "0.95")),
+            margin=float(os.environ.get("ADAPTIVE_MAX_TOKENS_MARGIN", "1.25"))
+        )
+
+    def budget(self, key: str, ceiling: int) -> int:
+        """max_tokens to request for this key"""
+        sketch = self.sketches.get(key)
+        if not self.enabled or sketch is None or sketch.count < self.min_samples:
+            return ceiling
+        return min(ceiling, max(self.floor, math.ceil(sketch.value() * self.margin)))
+
+    def observe(self, key: str, completion_tokens: int) -> None:
+        """Record the completion length of a call that was not cut short by its budget"""
+        if not self.enabled:
+            return
+        if key not in self.sketches:
+            if len(self.sketches) >= self.max_keys:
+                return
+            self.sketches[key] = P2Quantile(self.quantile)
+        self.sketches[key].add(completion_tokens)
+
+    def record_truncation(self, key: str) -> None:
+        self.truncations[key] = self.truncations.get(key, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "quantile": self.quantile,
+            "keys": {
+                key: {
+                    "samples": sketch.count,
+                    "completion_tokens_quantile": sketch.value(),
+                    "truncations": self.truncations.get(key, 0),
+                }
+                for key, sketch in self.sketches.items()
+            }
+        }
+
+
+token_budgeter = TokenBudgeter.from_env()
+
+
+def budget_key(request: BaseModel, key: str) -> Optional[str]:
+    """Budget key for a request, or None when the client set max_tokens explicitly"""
+    return None if "max_tokens" in request.model_fields_set else key
@@ -0,0 +1,3 @@
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for when no usage is reported"""
+    return len(text) // 4 + 1